@@ -2,247 +2,1304 @@
 """
 Claude API Integration for GitHub Workflows
 Provides helper functions for AI-assisted development workflows
+
+Requires: pip install anthropic tenacity
+Optional: pip install ijson orjson (stream large test reports, fast JSON encoding)
 """
 
+# anthropic, tenacity, asyncio, ijson and orjson are imported where they are
+# used, so --help, usage errors and empty test reports exit without paying
+# their import time.
 import os
 import json
 import sys
-from typing import Optional, Dict, List
-from anthropic import Anthropic
+import contextlib
+import collections
+import functools
+import hashlib
+import math
+import mmap
+import re
+import stat
+import tempfile
+import time
+from string import Template
+from typing import TYPE_CHECKING, Optional, Dict, List, Iterator, NamedTuple, TextIO, Tuple
 
+if TYPE_CHECKING:
+    from anthropic import Anthropic, AsyncAnthropic
 
-class ClaudeAssistant:
-    """Helper class for interacting with Claude API in GitHub Actions"""
 
-    def __init__(self, api_key: Optional[str] = None):
+NO_FAILURES_MESSAGE = "✅ No test failures detected"
+
+# Read timeout is per socket read: generous enough for non-streaming (--all) responses
+CLIENT_TIMEOUTS = dict(connect=5.0, read=120.0, write=10.0, pool=5.0)
+MAX_KEEPALIVE_CONNECTIONS = 10
+
+# Prompt input budgets, in (estimated) tokens
+CONTEXT_TOKEN_BUDGET = 1500
+DIFF_TOKEN_BUDGET = 3000
+# Conservative for Claude's tokenizer on code, so budgets over- rather than under-count
+CHARS_PER_TOKEN = 3
+# Bytes of a diff file decoded before token budgeting (head and tail of larger files)
+DIFF_READ_BUDGET_BYTES = 256 * 1024
+# Read size for diffs piped in rather than passed as a regular file
+STREAM_CHUNK_BYTES = 64 * 1024
+# Room reserved for one truncation marker line, in (estimated) tokens
+TRUNCATION_MARKER_TOKENS = 12
+# Smallest excerpt worth keeping of a file that does not fit the diff budget
+MIN_FILE_EXCERPT_TOKENS = 200
+
+
+def _estimate_tokens(text: str) -> int:
+    """Estimate the token count of text without an API round trip"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _budget(text: str, max_tokens: int, head_ratio: float = 0.7) -> str:
+    """
+    Fit text into a token budget, keeping its head and tail
+
+    Args:
+        text: Text to truncate
+        max_tokens: Token budget
+        head_ratio: Share of the budget spent on the start of the text
+
+    Returns:
+        Text unchanged if it fits, else head and tail joined by a truncation marker
+    """
+    total = _estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    head_tokens = int(max_tokens * head_ratio)
+    tail_chars = (max_tokens - head_tokens) * CHARS_PER_TOKEN
+    tail = text[-tail_chars:] if tail_chars else ""
+    return f"{text[:head_tokens * CHARS_PER_TOKEN]}\n...[truncated {total - max_tokens} tokens]...\n{tail}"
+
+
+def _budget_diff(diff: str, max_tokens: int) -> str:
+    """
+    Fit a git diff into a token budget, keeping whole files where possible
+
+    Files are kept whole in order while they fit; the budget left over is
+    then shared evenly across the files that did not fit, each keeping its
+    own head and tail. When there is not enough left for every such file
+    to get a useful excerpt, the rest are collapsed into a single marker.
+
+    Args:
+        diff: Git diff output
+        max_tokens: Token budget
+
+    Returns:
+        Diff that fits the budget
+    """
+    if _estimate_tokens(diff) <= max_tokens:
+        return diff
+
+    files = [f for f in re.split(r'(?m)^(?=diff --git )', diff) if f]
+    # Reserve room for the marker standing in for files that get no excerpt
+    remaining = max_tokens - TRUNCATION_MARKER_TOKENS
+    pieces = list(files)
+    oversized = []
+    for i, file_diff in enumerate(files):
+        tokens = _estimate_tokens(file_diff)
+        if tokens <= remaining:
+            remaining -= tokens
+        else:
+            oversized.append(i)
+
+    excerpts = min(len(oversized), remaining // MIN_FILE_EXCERPT_TOKENS)
+    for i in oversized[:excerpts]:
+        # _budget adds its own marker on top of the excerpt
+        pieces[i] = _budget(files[i], remaining // excerpts - TRUNCATION_MARKER_TOKENS)
+
+    omitted = oversized[excerpts:]
+    for i in omitted:
+        pieces[i] = ""
+    if omitted:
+        pieces.append(f"...[{len(omitted)} more files truncated]...\n")
+
+    return "".join(pieces)
+
+
+# Responses keyed by prompt hash, so workflow re-runs skip identical API calls
+CACHE_DIR = os.path.join(os.environ.get('RUNNER_TEMP', tempfile.gettempdir()), 'claude-cache')
+_memory_cache: Dict[str, str] = {}
+
+
+def _cache_key(params: Dict) -> str:
+    """Hash the model, token limit and full prompt of a Messages API request"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[str]:
+    """Look up a cached response, in memory first and then on disk"""
+    if key in _memory_cache:
+        return _memory_cache[key]
+
+    try:
+        with open(os.path.join(CACHE_DIR, f"{key}.md"), 'r', encoding='utf-8') as f:
+            _memory_cache[key] = f.read()
+    except OSError:
+        return None
+
+    return _memory_cache[key]
+
+
+class _CacheEntryWriter:
+    """
+    Write a response to the disk cache as it is produced (best effort)
+
+    Chunks go to a temporary file that is only renamed into place by
+    commit(), so a concurrent reader never sees a partial entry and an
+    interrupted response is never cached.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tmp_path = os.path.join(CACHE_DIR, f"{key}.{os.getpid()}.tmp")
+        self.file: Optional[TextIO] = None
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self.file = open(self.tmp_path, 'w', encoding='utf-8')
+        except OSError as e:
+            self._fail(e)
+
+    def _fail(self, error: OSError) -> None:
+        print(f"⚠️ Could not write response cache: {error}", file=sys.stderr)
+        self.file = None
+
+    def write(self, chunk: str) -> None:
+        if self.file:
+            try:
+                self.file.write(chunk)
+            except OSError as e:
+                self.discard()
+                self._fail(e)
+
+    def commit(self) -> None:
+        if self.file:
+            try:
+                self.file.close()
+                os.replace(self.tmp_path, os.path.join(CACHE_DIR, f"{self.key}.md"))
+            except OSError as e:
+                self.discard()
+                self._fail(e)
+
+    def discard(self) -> None:
+        if self.file:
+            self.file.close()
+            with contextlib.suppress(OSError):
+                os.remove(self.tmp_path)
+            self.file = None
+
+
+def _cache_put(key: str, text: str) -> None:
+    """Store a complete response in memory and on disk (best effort)"""
+    _memory_cache[key] = text
+    entry = _CacheEntryWriter(key)
+    entry.write(text)
+    entry.commit()
+
+
+# Seconds between Message Batch status checks in --batch mode
+BATCH_POLL_SECONDS = 30
+
+# Distinct failure groups sent to the model, most frequent first
+TOP_FAILURES = 20
+
+
+# Error recorded for failures whose report carries no message
+UNKNOWN_ERROR = 'Unknown error'
+
+
+def _failed_specs(suite: Dict) -> List[Dict]:
+    """Collect failed specs from a Playwright suite and its nested describe blocks"""
+    specs = [spec for spec in suite.get('specs', []) if spec.get('ok') is False]
+    for child in suite.get('suites', []):
+        specs.extend(_failed_specs(child))
+    return specs
+
+
+def _spec_error(spec: Dict) -> str:
+    """First error message of a failed Playwright spec, from its test results"""
+    for test in spec.get('tests', []):
+        for result in test.get('results', []):
+            message = (result.get('error') or {}).get('message')
+            if message:
+                return message
+
+    return (spec.get('error') or {}).get('message') or UNKNOWN_ERROR
+
+
+def _failures_from_suite(suite: Dict) -> List[Dict]:
+    """Extract failed specs from one Playwright suite"""
+    return [
+        {
+            'file': spec.get('file') or suite.get('file'),
+            'test': spec.get('title'),
+            'error': _spec_error(spec)
+        }
+        for spec in _failed_specs(suite)
+    ]
+
+
+def _extract_failures(test_report: Dict) -> List[Dict]:
+    """
+    Extract failed tests from a JSON test report
+
+    Args:
+        test_report: JSON test report (Vitest or Playwright)
+
+    Returns:
+        Failures with their file, test title and error message
+    """
+    failures = []
+
+    if 'testResults' in test_report:
+        # Vitest format
+        for test in test_report.get('testResults', []):
+            if test.get('status') == 'failed':
+                failures.append({
+                    'file': test.get('name'),
+                    'test': test.get('assertionResults', [{}])[0].get('title', 'Unknown'),
+                    'error': test.get('message') or UNKNOWN_ERROR
+                })
+    elif 'suites' in test_report:
+        # Playwright format
+        failures = [
+            failure
+            for suite in test_report.get('suites', [])
+            for failure in _failures_from_suite(suite)
+        ]
+
+    return failures
+
+
+def _failure_fingerprint(failure: Dict) -> str:
+    """Group key for a failure: first error line without colors, addresses and line numbers"""
+    first_line = (failure.get('error') or '').split('\n', 1)[0]
+    key = re.sub(r'\x1b\[[0-9;]*m|0x[0-9a-fA-F]+|:\d+', '', first_line).strip()
+    if not key or key == UNKNOWN_ERROR:
+        # No message to group on: keep the test apart rather than merging unrelated failures
+        return f"{failure.get('file')}::{failure.get('test')}"
+    return key
+
+
+def _dedupe_failures(failures: List[Dict], top_k: int = TOP_FAILURES) -> Tuple[List[Dict], int]:
+    """
+    Collapse failures sharing an error fingerprint into one counted exemplar
+
+    Args:
+        failures: Extracted test failures
+        top_k: Maximum number of groups to keep
+
+    Returns:
+        Exemplars of the top_k most frequent groups (each with a count),
+        and the total number of groups
+    """
+    counts: collections.Counter = collections.Counter()
+    exemplars: Dict[str, Dict] = {}
+    for failure in failures:
+        key = _failure_fingerprint(failure)
+        counts[key] += 1
+        exemplars.setdefault(key, failure)
+
+    return [{**exemplars[key], 'count': n} for key, n in counts.most_common(top_k)], len(counts)
+
+
+def _dumps_pretty(value) -> str:
+    """Serialize to 2-space indented JSON, with orjson's C encoder when installed"""
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(value, indent=2)
+
+    return orjson.dumps(value, option=orjson.OPT_INDENT_2).decode('utf-8')
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Retry rate limits, overloaded/5xx responses and dropped connections, not client errors"""
+    from anthropic import APIConnectionError, APIStatusError, RateLimitError
+
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Wait for the server's Retry-After delay when given, else back off exponentially"""
+    response = getattr(retry_state.outcome.exception(), 'response', None)
+    if response is not None:
+        try:
+            return min(float(response.headers['retry-after']), 60.0)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            pass
+
+    return _backoff()(retry_state)
+
+
+def _log_retry(retry_state) -> None:
+    """Log each retry to stderr so CI logs show why a step is waiting"""
+    print(
+        f"⚠️ {retry_state.outcome.exception()!r}, retrying in "
+        f"{retry_state.next_action.sleep:.0f}s (attempt {retry_state.attempt_number})",
+        file=sys.stderr
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _backoff():
+    """Exponential backoff used when the server gives no Retry-After"""
+    from tenacity import wait_exponential
+
+    return wait_exponential(multiplier=1, min=2, max=60)
+
+
+@functools.lru_cache(maxsize=None)
+def _retrying():
+    """Build the tenacity retry decorator on first use"""
+    from tenacity import retry, retry_if_exception, stop_after_attempt
+
+    return retry(
+        retry=retry_if_exception(_is_retryable),
+        wait=_wait_retry_after,
+        stop=stop_after_attempt(4),
+        before_sleep=_log_retry,
+        reraise=True
+    )
+
+
+def api_retry(fn):
+    """Retry an API call on transient errors (see _is_retryable)"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return _retrying()(fn)(*args, **kwargs)
+
+    return wrapper
+
+
+def async_api_retry(fn):
+    """Retry an async API call on transient errors (see _is_retryable)"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await _retrying()(fn)(*args, **kwargs)
+
+    return wrapper
+
+
+# Stack named in every system prompt; set ORA_FRAMEWORK to specialize the
+# prompts for a fork. Substituted once at import, so system prompts stay
+# byte-identical across calls. They are far below the minimum cacheable
+# prefix on their own: only spec, with a large codebase context after the
+# system prompt, is long enough to create a prompt cache entry.
+FRAMEWORK = os.environ.get('ORA_FRAMEWORK', 'Next.js 15 + TypeScript + Firebase')
+
+
+class PromptTemplate(NamedTuple):
+    """Static prompt of a command, compiled once at import"""
+    system: str
+    user: Template
+    max_tokens: int  # Hard cap on output tokens
+    base_tokens: int  # Output budget before scaling with input size
+    fast: bool = False
+    context: Optional[Template] = None
+    context_variable: Optional[str] = None
+
+
+_PROMPTS: Dict[str, PromptTemplate] = {
+    'spec': PromptTemplate(
+        system=f"""You are a technical architect for Ora Admin Portal ({FRAMEWORK}).
+
+When a feature request is filed, generate a detailed technical specification including:
+
+1. **Overview**: High-level summary
+2. **Architecture & Design**: Components, data flow, patterns
+3. **API Contracts**: Endpoints, request/response schemas (TypeScript)
+4. **Data Models**: Firestore collections/documents with TypeScript interfaces
+5. **Security Considerations**: Firestore rules, permissions, validation
+6. **Performance Considerations**: Optimizations, caching, scaling
+7. **Testing Strategy**: Unit tests, integration tests, E2E scenarios
+8. **Implementation Tasks**: Concrete checklist for developers
+
+Format in Markdown with TypeScript code blocks for schemas.
+Be specific and actionable. Reference existing patterns in the codebase.
+""",
+        context=Template("""**Codebase Context**:
+$codebase_context"""),
+        context_variable='codebase_context',
+        user=Template("""A feature request has been filed:
+
+**Title**: $issue_title
+
+**Details**:
+$issue_body
+"""),
+        max_tokens=4096,
+        base_tokens=1500
+    ),
+    'test-analysis': PromptTemplate(
+        system=f"""You are debugging test failures in Ora Admin Portal ({FRAMEWORK}).
+
+For each failure, provide:
+
+1. **Root Cause**: What's likely causing this failure?
+2. **Suggested Fix**: Specific code changes to resolve it
+3. **Prevention**: How to prevent similar issues in the future
+
+Failures shown are deduplicated exemplars; the count field indicates occurrences.
+
+Format as Markdown with code blocks for suggested fixes.
+Be concise but specific. Reference TypeScript/React best practices.
+""",
+        user=Template("""**Test Failures** ($summary):
+```json
+$failures
+```
+"""),
+        max_tokens=2048,
+        base_tokens=1024,
+        fast=True
+    ),
+    'pr-review': PromptTemplate(
+        system=f"""You are reviewing a Pull Request for Ora Admin Portal ({FRAMEWORK}).
+
+Review the code and provide:
+
+1. **Summary**: High-level assessment
+2. **Potential Issues**: Bugs, security concerns, performance problems
+3. **Suggestions**: Improvements for code quality, readability, maintainability
+4. **Security**: Any security considerations
+5. **Testing**: Are there sufficient tests?
+
+Format as Markdown. Be constructive and specific.
+Focus on:
+- TypeScript type safety
+- React best practices
+- Firebase security (Firestore rules, sensitive data)
+- Error handling
+- Performance implications
+""",
+        user=Template("""**PR Description**:
+$pr_description
+
+**Code Changes**:
+```diff
+$diff
+```
+"""),
+        max_tokens=2048,
+        base_tokens=1024
+    ),
+}
+
+
+def _connection_limits():
+    """
+    Connection pool limits for the SDK's HTTP client
+
+    Built from the SDK's own Limits class, since newer SDK releases ship
+    their own httpx fork and reject objects from the httpx package.
+    """
+    from anthropic import DEFAULT_CONNECTION_LIMITS
+
+    return type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=DEFAULT_CONNECTION_LIMITS.max_connections,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(api_key: str) -> "Anthropic":
+    """
+    Get the process-wide Anthropic client for an API key
+
+    The client keeps a pooled HTTP connection alive, so TLS setup is paid
+    once per process instead of once per call. Built-in retries are disabled
+    because API calls are retried by the caller.
+    """
+    from anthropic import Anthropic, DefaultHttpxClient, Timeout
+
+    timeout = Timeout(**CLIENT_TIMEOUTS)
+    return Anthropic(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=0,
+        http_client=DefaultHttpxClient(limits=_connection_limits(), timeout=timeout)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_async_client(api_key: str) -> "AsyncAnthropic":
+    """Get the process-wide AsyncAnthropic client for an API key (see _get_client)"""
+    from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient, Timeout
+
+    timeout = Timeout(**CLIENT_TIMEOUTS)
+    return AsyncAnthropic(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(limits=_connection_limits(), timeout=timeout)
+    )
+
+
+class _AssistantBase:
+    """Client setup, prompt rendering and response cache shared by the assistants"""
+
+    # Summarization/triage work goes to the fast model, design work to the smart one
+    FAST_MODEL = "claude-haiku-4-5"
+    SMART_MODEL = "claude-3-5-sonnet-20241022"
+
+    def __init__(self, api_key: Optional[str] = None, use_cache: bool = True):
         """
         Initialize Claude client
 
         Args:
             api_key: Anthropic API key (defaults to CLAUDE_API_KEY env var)
+            use_cache: Reuse responses to identical prompts (see CACHE_DIR)
         """
         self.api_key = api_key or os.environ.get('CLAUDE_API_KEY')
         if not self.api_key:
             raise ValueError("CLAUDE_API_KEY environment variable not set")
 
-        self.client = Anthropic(api_key=self.api_key)
-        self.model = "claude-3-5-sonnet-20241022"
+        self.client = self._create_client()
+        self.use_cache = use_cache
+
+    def _create_client(self):
+        """Get the shared Anthropic client used for API calls"""
+        return _get_client(self.api_key)
 
-    def generate_spec(self, issue_title: str, issue_body: str, codebase_context: str) -> str:
+    @staticmethod
+    def _cached_system(text: str) -> List[Dict]:
         """
-        Generate technical specification from feature request
+        Build a system prompt block marked for prompt caching
 
         Args:
-            issue_title: GitHub issue title
-            issue_body: GitHub issue body (from template)
-            codebase_context: Summary of codebase structure
+            text: Static instructions shared by every call of a command
 
         Returns:
-            Markdown technical specification
+            System content blocks with an ephemeral cache breakpoint
         """
-        prompt = f"""You are a technical architect for Ora Admin Portal (Next.js 15 + TypeScript + Firebase).
+        return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
 
-A feature request has been filed:
+    def _cache_lookup(self, params: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Look up a request in the response cache
 
-**Title**: {issue_title}
+        Args:
+            params: Messages API request parameters
 
-**Details**:
-{issue_body}
+        Returns:
+            Cache key (None when caching is disabled) and cached response, if any
+        """
+        key = _cache_key(params) if self.use_cache else None
+        cached = _cache_get(key) if key else None
+        if cached is not None:
+            print("♻️ Reusing cached response", file=sys.stderr)
+        return key, cached
 
-**Codebase Context**:
-{codebase_context[:4000]}
+    def _params(self, name: str, model: Optional[str] = None, **variables) -> Dict:
+        """
+        Render a prompt template into Messages API parameters
 
-Generate a detailed technical specification including:
+        Args:
+            name: Prompt template name (see _PROMPTS)
+            model: Model override (defaults to the template's fast/smart model)
+            **variables: Template variables
 
-1. **Overview**: High-level summary
-2. **Architecture & Design**: Components, data flow, patterns
-3. **API Contracts**: Endpoints, request/response schemas (TypeScript)
-4. **Data Models**: Firestore collections/documents with TypeScript interfaces
-5. **Security Considerations**: Firestore rules, permissions, validation
-6. **Performance Considerations**: Optimizations, caching, scaling
-7. **Testing Strategy**: Unit tests, integration tests, E2E scenarios
-8. **Implementation Tasks**: Concrete checklist for developers
+        Returns:
+            Keyword arguments for messages.create / messages.stream
+        """
+        prompt = _PROMPTS[name]
 
-Format in Markdown with TypeScript code blocks for schemas.
-Be specific and actionable. Reference existing patterns in the codebase.
-"""
+        # Scale the output budget with the input, and ask for an answer that fits it
+        input_tokens = sum(_estimate_tokens(str(value)) for value in variables.values())
+        max_tokens = min(prompt.max_tokens, prompt.base_tokens + 2 * input_tokens)
+        concise = f"\nBe concise: respond in under {max_tokens // 2} words.\n"
+
+        content = []
+        if prompt.context and prompt.context_variable and variables.get(prompt.context_variable):
+            # Context is shared across calls, so cache it after the system prompt
+            content.append({
+                "type": "text",
+                "text": prompt.context.substitute(variables),
+                "cache_control": {"type": "ephemeral"}
+            })
+        content.append({"type": "text", "text": prompt.user.substitute(variables) + concise})
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=4096,
-            messages=[{"role": "user", "content": prompt}]
+        return dict(
+            model=model or (self.FAST_MODEL if prompt.fast else self.SMART_MODEL),
+            max_tokens=max_tokens,
+            system=self._cached_system(prompt.system),
+            messages=[{"role": "user", "content": content}]
         )
 
-        return response.content[0].text
+    def _request(self, command: str, inputs: Dict, model: Optional[str] = None) -> Optional[Dict]:
+        """
+        Build the Messages API parameters for a CLI command
+
+        Args:
+            command: CLI command name (see COMMANDS), also its prompt template name
+            inputs: Command inputs, as returned by load_inputs
+            model: Model override
 
-    def analyze_test_failures(self, test_report: Dict) -> str:
+        Returns:
+            Keyword arguments for messages.create / messages.stream, or None
+            when the command needs no API call (no test failures)
         """
-        Analyze test failures and suggest fixes
+        if command == 'spec':
+            return self._params("spec", model, issue_title=inputs['issue_title'],
+                                issue_body=inputs['issue_body'],
+                                codebase_context=_budget(inputs['codebase_context'], CONTEXT_TOKEN_BUDGET))
+
+        if command == 'test-analysis':
+            failures = inputs['failures']
+            if not failures:
+                return None
+
+            exemplars, groups = _dedupe_failures(failures)
+            summary = f"{len(exemplars)} of {groups} distinct errors, {len(failures)} failures in total"
+            return self._params("test-analysis", model, summary=summary, failures=_dumps_pretty(exemplars))
+
+        return self._params("pr-review", model, pr_description=inputs['pr_description'],
+                            diff=_budget_diff(inputs['diff'], DIFF_TOKEN_BUDGET))
+
+
+class ClaudeAssistant(_AssistantBase):
+    """Helper class for interacting with Claude API in GitHub Actions"""
+
+    def __init__(self, api_key: Optional[str] = None, use_cache: bool = True):
+        """
+        Initialize Claude client
 
         Args:
-            test_report: JSON test report (Vitest or Playwright)
+            api_key: Anthropic API key (defaults to CLAUDE_API_KEY env var)
+            use_cache: Reuse responses to identical prompts (see CACHE_DIR)
+        """
+        super().__init__(api_key, use_cache)
+        self.last_usage = None
+
+    @api_retry
+    def _open_stream(self, stack: contextlib.ExitStack, params: Dict):
+        """
+        Open a Messages API stream, retrying transient errors
+
+        Only opening the stream is retried: once text has been emitted,
+        a retry would duplicate output.
+
+        Args:
+            stack: Exit stack that will close the stream
+            params: Keyword arguments forwarded to messages.stream
 
         Returns:
-            Markdown analysis with suggested fixes
+            Open message stream
         """
-        # Extract failures
-        failures = []
+        return stack.enter_context(self.client.messages.stream(**params))
 
-        if 'testResults' in test_report:
-            # Vitest format
-            for test in test_report.get('testResults', []):
-                if test.get('status') == 'failed':
-                    failures.append({
-                        'file': test.get('name'),
-                        'test': test.get('assertionResults', [{}])[0].get('title', 'Unknown'),
-                        'error': test.get('message', 'Unknown error')
-                    })
-        elif 'suites' in test_report:
-            # Playwright format
-            for suite in test_report.get('suites', []):
-                for test in suite.get('specs', []):
-                    if test.get('ok') is False:
-                        failures.append({
-                            'file': suite.get('file'),
-                            'test': test.get('title'),
-                            'error': test.get('error', {}).get('message', 'Unknown error')
-                        })
+    def _stream(self, **params) -> Iterator[str]:
+        """
+        Stream a Messages API response as text chunks
 
-        if not failures:
-            return "✅ No test failures detected"
+        Args:
+            **params: Keyword arguments forwarded to messages.stream
 
-        prompt = f"""You are debugging test failures in Ora Admin Portal (Next.js 15 + TypeScript + Firebase).
+        Returns:
+            Text chunks as they are generated (token usage is kept for log_usage)
+        """
+        key, cached = self._cache_lookup(params)
+        if cached is not None:
+            yield cached
+            return
 
-**Test Failures**:
-```json
-{json.dumps(failures, indent=2)}
-```
+        # Chunks are written through to the cache instead of being buffered here
+        entry = _CacheEntryWriter(key) if key else None
+        try:
+            with contextlib.ExitStack() as stack:
+                stream = self._open_stream(stack, params)
+                for chunk in stream.text_stream:
+                    if entry:
+                        entry.write(chunk)
+                    yield chunk
+                usage = stream.get_final_message().usage
+        except BaseException:
+            # Only cache responses that streamed to completion
+            if entry:
+                entry.discard()
+            raise
 
-For each failure, provide:
+        if entry:
+            entry.commit()
 
-1. **Root Cause**: What's likely causing this failure?
-2. **Suggested Fix**: Specific code changes to resolve it
-3. **Prevention**: How to prevent similar issues in the future
+        self.last_usage = usage
 
-Format as Markdown with code blocks for suggested fixes.
-Be concise but specific. Reference TypeScript/React best practices.
-"""
+    def log_usage(self) -> None:
+        """
+        Log the token usage of the last streamed response to stderr
+
+        Called once the response has been fully written, so the log line
+        never lands on the same line as the response in a merged CI log.
+        """
+        usage = self.last_usage
+        if usage is None:
+            return
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=2048,
-            messages=[{"role": "user", "content": prompt}]
+        print(
+            f"ℹ️ Tokens: {usage.input_tokens} in, {usage.output_tokens} out "
+            f"(cache read: {getattr(usage, 'cache_read_input_tokens', 0) or 0})",
+            file=sys.stderr
         )
 
-        return response.content[0].text
+    def run(self, command: str, inputs: Dict, model: Optional[str] = None) -> Iterator[str]:
+        """
+        Run a CLI command and stream the response
+
+        Args:
+            command: CLI command name (see COMMANDS)
+            inputs: Command inputs, as returned by load_inputs
+            model: Model override
+
+        Returns:
+            Markdown response, streamed chunk by chunk
+        """
+        params = self._request(command, inputs, model)
+        if params is None:
+            return iter([NO_FAILURES_MESSAGE])
+
+        return self._stream(**params)
+
+    def generate_spec(self, issue_title: str, issue_body: str, codebase_context: str,
+                      model: Optional[str] = None) -> Iterator[str]:
+        """
+        Generate technical specification from feature request
+
+        Args:
+            issue_title: GitHub issue title
+            issue_body: GitHub issue body (from template)
+            codebase_context: Summary of codebase structure
+            model: Model override (defaults to SMART_MODEL)
+
+        Returns:
+            Markdown technical specification, streamed chunk by chunk
+        """
+        return self.run("spec", {'issue_title': issue_title, 'issue_body': issue_body,
+                                 'codebase_context': codebase_context}, model)
+
+    def analyze_test_failures(self, test_report: Dict, model: Optional[str] = None) -> Iterator[str]:
+        """
+        Analyze test failures and suggest fixes
 
-    def review_pr(self, diff: str, pr_description: str) -> str:
+        Args:
+            test_report: JSON test report (Vitest or Playwright)
+            model: Model override (defaults to FAST_MODEL)
+
+        Returns:
+            Markdown analysis with suggested fixes, streamed chunk by chunk
+        """
+        return self.analyze_failures(_extract_failures(test_report), model)
+
+    def analyze_failures(self, failures: List[Dict], model: Optional[str] = None) -> Iterator[str]:
+        """
+        Analyze test failures already extracted from a report and suggest fixes
+
+        Args:
+            failures: Failures as returned by _extract_failures
+            model: Model override (defaults to FAST_MODEL)
+
+        Returns:
+            Markdown analysis with suggested fixes, streamed chunk by chunk
+        """
+        return self.run("test-analysis", {'failures': failures}, model)
+
+    def review_pr(self, diff: str, pr_description: str, model: Optional[str] = None) -> Iterator[str]:
         """
         Review PR code changes
 
         Args:
             diff: Git diff output
             pr_description: PR description
+            model: Model override (defaults to SMART_MODEL)
 
         Returns:
-            Markdown review with suggestions
+            Markdown review with suggestions, streamed chunk by chunk
         """
-        prompt = f"""You are reviewing a Pull Request for Ora Admin Portal (Next.js 15 + TypeScript + Firebase).
-
-**PR Description**:
-{pr_description}
+        return self.run("pr-review", {'diff': diff, 'pr_description': pr_description}, model)
 
-**Code Changes**:
-```diff
-{diff[:8000]}
-```
 
-Review the code and provide:
+class AsyncClaudeAssistant(_AssistantBase):
+    """Async assistant for running several commands concurrently over one client"""
 
-1. **Summary**: High-level assessment
-2. **Potential Issues**: Bugs, security concerns, performance problems
-3. **Suggestions**: Improvements for code quality, readability, maintainability
-4. **Security**: Any security considerations
-5. **Testing**: Are there sufficient tests?
+    def _create_client(self):
+        """Get the shared async Anthropic client used by all concurrent calls"""
+        return _get_async_client(self.api_key)
 
-Format as Markdown. Be constructive and specific.
-Focus on:
-- TypeScript type safety
-- React best practices
-- Firebase security (Firestore rules, sensitive data)
-- Error handling
-- Performance implications
-"""
+    @async_api_retry
+    async def _create(self, **params) -> str:
+        """
+        Send a Messages API request and return the full response text,
+        retrying transient errors
 
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=2048,
-            messages=[{"role": "user", "content": prompt}]
-        )
+        Args:
+            **params: Keyword arguments forwarded to messages.create
 
+        Returns:
+            Response text
+        """
+        response = await self.client.messages.create(**params)
         return response.content[0].text
 
+    async def run(self, command: str, inputs: Dict, model: Optional[str] = None) -> str:
+        """
+        Run a CLI command, from the response cache when possible
+
+        Args:
+            command: CLI command name (see COMMANDS)
+            inputs: Command inputs, as returned by load_inputs
+            model: Model override
+
+        Returns:
+            Full Markdown response
+        """
+        params = self._request(command, inputs, model)
+        if params is None:
+            return NO_FAILURES_MESSAGE
+
+        key, cached = self._cache_lookup(params)
+        if cached is not None:
+            return cached
+
+        text = await self._create(**params)
+        if key:
+            _cache_put(key, text)
+
+        return text
+
+
+class BatchClaudeAssistant(_AssistantBase):
+    """
+    Assistant that queues commands into one Message Batch
+
+    Batches are processed asynchronously at half the token cost, which suits
+    nightly and post-merge jobs. run() queues a command and submit() runs
+    the queue.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, use_cache: bool = True):
+        """
+        Initialize Claude client
+
+        Args:
+            api_key: Anthropic API key (defaults to CLAUDE_API_KEY env var)
+            use_cache: Reuse responses to identical prompts (see CACHE_DIR)
+        """
+        super().__init__(api_key, use_cache)
+        self.pending: Dict[str, Dict] = {}
+
+    def run(self, command: str, inputs: Dict, model: Optional[str] = None) -> Optional[str]:
+        """
+        Queue a CLI command for the batch, unless its response is already known
+
+        Args:
+            command: CLI command name (see COMMANDS), used as the batch custom_id
+            inputs: Command inputs, as returned by load_inputs
+            model: Model override
+
+        Returns:
+            Markdown response when known without an API call (cache hit, no
+            failures), or None when the request was queued for submit()
+        """
+        params = self._request(command, inputs, model)
+        if params is None:
+            return NO_FAILURES_MESSAGE
+
+        _, cached = self._cache_lookup(params)
+        if cached is not None:
+            return cached
+
+        self.pending[command] = params
+        return None
+
+    @api_retry
+    def _create_batch(self, requests: List[Dict]):
+        """Submit a Message Batch, retrying transient errors"""
+        return self.client.messages.batches.create(requests=requests)
+
+    @api_retry
+    def _retrieve_batch(self, batch_id: str):
+        """Fetch a Message Batch's status, retrying transient errors"""
+        return self.client.messages.batches.retrieve(batch_id)
+
+    @api_retry
+    def _batch_results(self, batch_id: str) -> List:
+        """Fetch every result of an ended Message Batch, retrying transient errors"""
+        return list(self.client.messages.batches.results(batch_id))
+
+    def _batch_id_path(self, requests: List[Dict]) -> Optional[str]:
+        """File recording the batch submitted for these requests (None when caching is disabled)"""
+        if not self.use_cache:
+            return None
+        return os.path.join(CACHE_DIR, f"batch-{_cache_key({'requests': requests})}.id")
+
+    def submit(self, poll_interval: float = BATCH_POLL_SECONDS,
+               batch_id: Optional[str] = None) -> Dict[str, str]:
+        """
+        Submit the queued requests as one batch and wait for the results
+
+        The batch id is recorded in CACHE_DIR until its results are in, so a
+        re-run after a timeout resumes the same batch instead of paying for
+        a new one. Successful responses are cached as soon as they arrive,
+        so re-running after a partial failure only resubmits the failed
+        requests.
+
+        Args:
+            poll_interval: Seconds between status checks
+            batch_id: Existing batch for the same requests to resume instead of submitting
+
+        Returns:
+            Response text per queued command name
+        """
+        if not self.pending:
+            return {}
+
+        requests = [{"custom_id": name, "params": params} for name, params in self.pending.items()]
+        id_path = self._batch_id_path(requests)
+        if not batch_id and id_path:
+            with contextlib.suppress(OSError), open(id_path, 'r', encoding='utf-8') as f:
+                batch_id = f.read().strip()
+
+        if batch_id:
+            batch = self._retrieve_batch(batch_id)
+            print(f"📦 Resuming batch {batch.id}", file=sys.stderr)
+        else:
+            batch = self._create_batch(requests)
+            print(f"📦 Submitted batch {batch.id} ({len(requests)} requests, "
+                  f"resume with --batch-id {batch.id})", file=sys.stderr)
+            if id_path:
+                try:
+                    os.makedirs(CACHE_DIR, exist_ok=True)
+                    with open(id_path, 'w', encoding='utf-8') as f:
+                        f.write(batch.id)
+                except OSError as e:
+                    print(f"⚠️ Could not record batch id: {e}", file=sys.stderr)
+
+        while batch.processing_status != "ended":
+            time.sleep(poll_interval)
+            batch = self._retrieve_batch(batch.id)
+            print(f"⏳ Batch {batch.id}: {batch.processing_status}", file=sys.stderr)
+
+        results = {}
+        failed = []
+        for entry in self._batch_results(batch.id):
+            if entry.result.type != "succeeded":
+                failed.append(f"{entry.custom_id} ({entry.result.type})")
+                continue
+
+            text = entry.result.message.content[0].text
+            results[entry.custom_id] = text
+            if self.use_cache and entry.custom_id in self.pending:
+                _cache_put(_cache_key(self.pending[entry.custom_id]), text)
+
+        # The batch has ended, so a re-run must submit its failed requests anew
+        if id_path:
+            with contextlib.suppress(OSError):
+                os.remove(id_path)
+
+        if failed:
+            raise RuntimeError(f"Batch requests did not succeed: {', '.join(failed)}")
+
+        self.pending = {}
+        return results
+
+
+# CLI command -> (required arguments, usage error)
+COMMANDS = {
+    'spec': (('issue_title', 'issue_body'),
+             "--issue-title and --issue-body required for spec generation"),
+    'test-analysis': (('test_report',),
+                      "--test-report required for test analysis"),
+    'pr-review': (('diff', 'pr_description'),
+                  "--diff and --pr-description required for PR review"),
+}
+
+
+def load_test_report(path: str) -> Dict:
+    """
+    Load a JSON test report (Vitest or Playwright)
+
+    With ijson installed the report is streamed and only failed tests are
+    kept, so memory grows with the number of failures, not the report size.
+
+    Args:
+        path: Test report file path
+
+    Returns:
+        Test report, pruned to failed tests when streamed
+    """
+    try:
+        import ijson
+    except ImportError:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    with open(path, 'rb') as f:
+        # Find which format this is from the first matching top-level key
+        report_key = next((value for prefix, event, value in ijson.parse(f)
+                           if prefix == '' and event == 'map_key' and value in ('testResults', 'suites')),
+                          None)
+        f.seek(0)
+
+        if report_key == 'testResults':
+            # Vitest format
+            return {'testResults': [test for test in ijson.items(f, 'testResults.item', use_float=True)
+                                    if test.get('status') == 'failed']}
+
+        if report_key == 'suites':
+            # Playwright format
+            suites = []
+            for suite in ijson.items(f, 'suites.item', use_float=True):
+                specs = _failed_specs(suite)
+                if specs:
+                    suites.append({'file': suite.get('file'), 'specs': specs})
+            return {'suites': suites}
+
+    return {}
+
+
+def _read_diff_stream(f, max_bytes: int, head_ratio: float) -> str:
+    """
+    Read a pipe or other unsized input, keeping at most max_bytes of it
+
+    The head is read up front and the tail kept in a rolling buffer, so
+    memory stays bounded however much is piped in.
+    """
+    data = f.read(max_bytes)
+    size = len(data)
+    head_bytes = int(max_bytes * head_ratio)
+    tail_bytes = max_bytes - head_bytes
+    tail = bytearray(data[head_bytes:])
+    while True:
+        chunk = f.read(STREAM_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        tail += chunk
+        del tail[:max(len(tail) - tail_bytes, 0)]
+
+    if size <= max_bytes:
+        return data.decode('utf-8', 'replace')
+
+    head = data[:head_bytes].decode('utf-8', 'replace')
+    return f"{head}\n...[truncated {size - max_bytes} bytes]...\n{tail.decode('utf-8', 'replace')}"
+
+
+def read_diff(path: str, max_bytes: int = DIFF_READ_BUDGET_BYTES, head_ratio: float = 0.7) -> str:
+    """
+    Read a diff file, decoding at most max_bytes of it
+
+    Regular files are memory-mapped so a huge diff is never read or decoded
+    in full; pipes (e.g. --diff <(git diff)) are streamed instead. Larger
+    inputs keep their head and tail around a truncation marker.
+
+    Args:
+        path: Diff file path
+        max_bytes: Maximum number of bytes to decode
+        head_ratio: Share of max_bytes taken from the start of the file
+
+    Returns:
+        Decoded diff text
+    """
+    with open(path, 'rb') as f:
+        info = os.fstat(f.fileno())
+        if not stat.S_ISREG(info.st_mode):
+            # Pipes report no size and cannot be mapped
+            return _read_diff_stream(f, max_bytes, head_ratio)
+
+        size = info.st_size
+        if size == 0:
+            return ""
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if size <= max_bytes:
+                return mm[:].decode('utf-8', 'replace')
+
+            head_bytes = int(max_bytes * head_ratio)
+            tail_bytes = max_bytes - head_bytes
+            head = mm[:head_bytes].decode('utf-8', 'replace')
+            tail = mm[size - tail_bytes:].decode('utf-8', 'replace') if tail_bytes else ""
+            return f"{head}\n...[truncated {size - max_bytes} bytes]...\n{tail}"
+
+
+def _positive_int(value: str) -> int:
+    """argparse type for integer options that must be greater than zero"""
+    import argparse
+
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {number}")
+    return number
+
+
+def load_inputs(command: str, args) -> Dict:
+    """
+    Read the files referenced by CLI arguments for a command
+
+    Args:
+        command: CLI command name
+        args: Parsed CLI arguments
+
+    Returns:
+        Command inputs for the assistants' run()
+    """
+    if command == 'spec':
+        codebase_context = ""
+        if args.codebase_context:
+            with open(args.codebase_context, 'r', encoding='utf-8') as f:
+                codebase_context = f.read()
+
+        return {'issue_title': args.issue_title, 'issue_body': args.issue_body,
+                'codebase_context': codebase_context}
+
+    if command == 'test-analysis':
+        return {'failures': _extract_failures(load_test_report(args.test_report))}
+
+    diff = read_diff(args.diff, args.diff_budget_bytes)
+    if not diff.strip():
+        raise ValueError(f"Diff {args.diff} is empty, nothing to review")
+
+    return {'diff': diff, 'pr_description': args.pr_description}
+
+
+async def run_all(commands: List[str], args) -> List[str]:
+    """
+    Run several commands concurrently over one shared async client
+
+    Args:
+        commands: CLI command names to run
+        args: Parsed CLI arguments
+
+    Returns:
+        Full Markdown response per command, in the same order as commands
+    """
+    import asyncio
+
+    assistant = AsyncClaudeAssistant(use_cache=not args.no_cache)
+    return await asyncio.gather(*(assistant.run(command, load_inputs(command, args), args.model)
+                                  for command in commands))
+
+
+def run_batch(commands: List[str], args) -> List[str]:
+    """
+    Run several commands as one Message Batch
+
+    Args:
+        commands: CLI command names to run
+        args: Parsed CLI arguments
+
+    Returns:
+        Full Markdown response per command, in the same order as commands
+    """
+    assistant = BatchClaudeAssistant(use_cache=not args.no_cache)
+    # None marks a command queued for the batch rather than answered already
+    replies = [assistant.run(command, load_inputs(command, args), args.model) for command in commands]
+    batch_results = assistant.submit(batch_id=args.batch_id)
+    return [reply if reply is not None else batch_results[command]
+            for command, reply in zip(commands, replies)]
+
 
 def main():
     """CLI entry point for GitHub Actions"""
     import argparse
 
     parser = argparse.ArgumentParser(description='Claude API helper for GitHub workflows')
-    parser.add_argument('command', choices=['spec', 'test-analysis', 'pr-review'],
+    parser.add_argument('command', nargs='?', choices=list(COMMANDS),
                         help='Command to execute')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--all', action='store_true',
+                      help='Run every command whose arguments are provided, concurrently')
+    mode.add_argument('--batch', action='store_true',
+                      help='Run every command whose arguments are provided as one Message Batch '
+                           '(half price, results can take minutes)')
+    parser.add_argument('--batch-id', help='With --batch, resume this Message Batch instead of submitting a new one')
     parser.add_argument('--issue-title', help='GitHub issue title')
     parser.add_argument('--issue-body', help='GitHub issue body')
     parser.add_argument('--codebase-context', help='Codebase summary file path')
     parser.add_argument('--test-report', help='Test report JSON file path')
     parser.add_argument('--diff', help='Git diff file path')
     parser.add_argument('--pr-description', help='PR description')
-    parser.add_argument('--output', help='Output file path (default: stdout)')
+    parser.add_argument('--diff-budget-bytes', type=_positive_int, default=DIFF_READ_BUDGET_BYTES,
+                        help='Maximum bytes of the diff file to read (default: %(default)s)')
+    parser.add_argument('--model', help='Claude model override (default: fast model for test analysis, smart model otherwise)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always call the API instead of reusing cached responses')
+    parser.add_argument('--output', help='Output file path, or directory with --all/--batch (default: stdout)')
 
     args = parser.parse_args()
 
-    try:
-        assistant = ClaudeAssistant()
-        result = ""
-
-        if args.command == 'spec':
-            if not args.issue_title or not args.issue_body:
-                print("Error: --issue-title and --issue-body required for spec generation", file=sys.stderr)
-                sys.exit(1)
-
-            codebase_context = ""
-            if args.codebase_context:
-                with open(args.codebase_context, 'r', encoding='utf-8') as f:
-                    codebase_context = f.read()
-
-            result = assistant.generate_spec(args.issue_title, args.issue_body, codebase_context)
+    if not (args.all or args.batch) and not args.command:
+        parser.error('a command is required unless --all or --batch is given')
+    if args.batch_id and not args.batch:
+        parser.error('--batch-id requires --batch')
 
-        elif args.command == 'test-analysis':
-            if not args.test_report:
-                print("Error: --test-report required for test analysis", file=sys.stderr)
+    try:
+        if args.all or args.batch:
+            commands = [command for command, (required, _) in COMMANDS.items()
+                        if all(getattr(args, name) for name in required)]
+            if not commands:
+                flag = '--all' if args.all else '--batch'
+                print(f"Error: {flag} requires the arguments of at least one command", file=sys.stderr)
                 sys.exit(1)
 
-            with open(args.test_report, 'r', encoding='utf-8') as f:
-                test_report = json.load(f)
+            if args.all:
+                import asyncio
 
-            result = assistant.analyze_test_failures(test_report)
+                results = asyncio.run(run_all(commands, args))
+            else:
+                results = run_batch(commands, args)
 
-        elif args.command == 'pr-review':
-            if not args.diff or not args.pr_description:
-                print("Error: --diff and --pr-description required for PR review", file=sys.stderr)
-                sys.exit(1)
+            # Output one result per command
+            if args.output:
+                os.makedirs(args.output, exist_ok=True)
+                for command, result in zip(commands, results):
+                    path = os.path.join(args.output, f"{command}.md")
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(result)
+                    print(f"✅ Output written to {path}")
+            else:
+                for command, result in zip(commands, results):
+                    print(f"## {command}\n\n{result}\n")
+            return
 
-            with open(args.diff, 'r', encoding='utf-8') as f:
-                diff = f.read()
+        required, usage_error = COMMANDS[args.command]
+        if not all(getattr(args, name) for name in required):
+            print(f"Error: {usage_error}", file=sys.stderr)
+            sys.exit(1)
 
-            result = assistant.review_pr(diff, args.pr_description)
+        inputs = load_inputs(args.command, args)
+        assistant = None
+        if args.command == 'test-analysis' and not inputs['failures']:
+            # Green runs are the common case: answer without creating a client
+            chunks = iter([NO_FAILURES_MESSAGE])
+        else:
+            assistant = ClaudeAssistant(use_cache=not args.no_cache)
+            chunks = assistant.run(args.command, inputs, args.model)
 
-        # Output result
+        # Output result as it streams in
         if args.output:
             with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(result)
+                for chunk in chunks:
+                    f.write(chunk)
+                    f.flush()
             print(f"✅ Output written to {args.output}")
         else:
-            print(result)
+            for chunk in chunks:
+                print(chunk, end='', flush=True)
+            print(flush=True)
+
+        if assistant:
+            assistant.log_usage()
 
     except Exception as e:
         print(f"❌ Error: {e}", file=sys.stderr)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Tests for claude-api.py
+
+Run with: python -m unittest discover -s .github/scripts
+"""
+
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import threading
+import types
+import unittest
+from typing import List, Optional
+from unittest import mock
+
+_spec = importlib.util.spec_from_file_location(
+    'claude_api', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'claude-api.py')
+)
+claude_api = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(claude_api)
+
+
+def _file_diff(path: str, lines: int) -> str:
+    """Build a git diff for one file adding the given number of lines"""
+    body = "".join(f"+line {i} of {path}\n" for i in range(lines))
+    return (
+        f"diff --git a/{path} b/{path}\n"
+        f"--- a/{path}\n"
+        f"+++ b/{path}\n"
+        f"@@ -0,0 +1,{lines} @@\n"
+        f"{body}"
+    )
+
+
+class BudgetDiffTest(unittest.TestCase):
+    def test_large_file_gets_leftover_budget(self):
+        large = _file_diff('src/large.ts', 1000)
+        small = _file_diff('README.md', 1)
+        budgeted = claude_api._budget_diff(large + small, 3000)
+
+        # The small file is kept whole and the large one keeps its head and tail
+        self.assertIn(small, budgeted)
+        self.assertTrue(budgeted.startswith(large[:1000]))
+        self.assertIn('+line 999 of src/large.ts', budgeted.split(small)[0])
+        self.assertIn('...[truncated', budgeted)
+
+        # The leftover budget is used rather than thrown away
+        used = claude_api._estimate_tokens(budgeted)
+        self.assertGreater(used, 2900)
+        self.assertLess(used, 3050)
+
+    def test_many_medium_files_stay_within_budget(self):
+        diff = "".join(_file_diff(f'src/file{i}.ts', 40) for i in range(400))
+        budgeted = claude_api._budget_diff(diff, 3000)
+
+        self.assertLessEqual(claude_api._estimate_tokens(budgeted),
+                             3000 + claude_api.TRUNCATION_MARKER_TOKENS)
+        self.assertTrue(budgeted.startswith(_file_diff('src/file0.ts', 40)))
+        self.assertRegex(budgeted, r'\.\.\.\[\d+ more files truncated\]\.\.\.\n$')
+
+    def test_diff_within_budget_is_unchanged(self):
+        diff = _file_diff('a.ts', 5) + _file_diff('b.ts', 5)
+        self.assertEqual(claude_api._budget_diff(diff, 3000), diff)
+
+
+class ReadDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.content = "".join(f"line {i}\n" for i in range(1000)).encode()
+
+    def test_regular_file_over_budget_keeps_head_and_tail(self):
+        path = os.path.join(self.tmp.name, 'big.diff')
+        with open(path, 'wb') as f:
+            f.write(self.content)
+
+        diff = claude_api.read_diff(path, max_bytes=100)
+
+        head, rest = diff.split('\n...[truncated ', 1)
+        marker, tail = rest.split(']...\n', 1)
+        self.assertEqual(head, self.content[:70].decode())
+        self.assertEqual(marker, f"{len(self.content) - 100} bytes")
+        self.assertEqual(tail, self.content[-30:].decode())
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'needs named pipes')
+    def test_pipe_is_streamed_like_a_regular_file(self):
+        path = os.path.join(self.tmp.name, 'pipe.diff')
+        os.mkfifo(path)
+
+        def write():
+            with open(path, 'wb') as f:
+                f.write(self.content)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        diff = claude_api.read_diff(path, max_bytes=100)
+        writer.join()
+
+        regular = os.path.join(self.tmp.name, 'big.diff')
+        with open(regular, 'wb') as f:
+            f.write(self.content)
+        self.assertEqual(diff, claude_api.read_diff(regular, max_bytes=100))
+
+
+class _StubStream:
+    """Messages API stream that yields fixed chunks, optionally failing partway"""
+
+    def __init__(self, chunks: List[str], fail_after: Optional[int] = None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    @property
+    def text_stream(self):
+        for i, chunk in enumerate(self.chunks):
+            if i == self.fail_after:
+                raise ConnectionError("stream dropped")
+            yield chunk
+
+    def get_final_message(self):
+        return types.SimpleNamespace(usage=types.SimpleNamespace(input_tokens=1, output_tokens=1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _StubAssistant(claude_api.ClaudeAssistant):
+    """ClaudeAssistant whose streams come from a list instead of the API"""
+
+    def __init__(self, streams: List[_StubStream], use_cache: bool = True):
+        self.streams = streams
+        super().__init__(api_key='test-key', use_cache=use_cache)
+
+    def _create_client(self):
+        return None
+
+    def _open_stream(self, stack, params):
+        return stack.enter_context(self.streams.pop(0))
+
+
+class ResponseCacheTest(unittest.TestCase):
+    params = {'model': 'test-model', 'max_tokens': 10, 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, 'claude-cache')
+        for patch in (mock.patch.object(claude_api, 'CACHE_DIR', self.cache_dir),
+                      mock.patch.dict(claude_api._memory_cache, clear=True),
+                      mock.patch('sys.stderr', new_callable=io.StringIO)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_completed_stream_is_cached_in_memory_and_on_disk(self):
+        assistant = _StubAssistant([_StubStream(['Hello ', 'world'])])
+        self.assertEqual("".join(assistant._stream(**self.params)), 'Hello world')
+
+        key = claude_api._cache_key(self.params)
+        self.assertEqual(os.listdir(self.cache_dir), [f'{key}.md'])
+
+        # No streams left: both lookups must be answered from the cache
+        self.assertEqual("".join(assistant._stream(**self.params)), 'Hello world')
+        claude_api._memory_cache.clear()
+        self.assertEqual("".join(assistant._stream(**self.params)), 'Hello world')
+
+    def test_interrupted_stream_is_not_cached(self):
+        assistant = _StubAssistant([_StubStream(['Hello ', 'world'], fail_after=1)])
+        with self.assertRaises(ConnectionError):
+            "".join(assistant._stream(**self.params))
+
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertEqual(claude_api._memory_cache, {})
+
+    def test_disabled_cache_always_streams(self):
+        assistant = _StubAssistant([_StubStream(['one']), _StubStream(['two'])], use_cache=False)
+        self.assertEqual("".join(assistant._stream(**self.params)), 'one')
+        self.assertEqual("".join(assistant._stream(**self.params)), 'two')
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class _StubBatchAssistant(claude_api.BatchClaudeAssistant):
+    """BatchClaudeAssistant whose Message Batches API calls are recorded instead of sent"""
+
+    def __init__(self, fail_results: bool = False):
+        self.calls: List[str] = []
+        self.fail_results = fail_results
+        super().__init__(api_key='test-key')
+
+    def _create_client(self):
+        return None
+
+    def _create_batch(self, requests):
+        self.calls.append('create')
+        return types.SimpleNamespace(id='batch_1', processing_status='in_progress')
+
+    def _retrieve_batch(self, batch_id):
+        self.calls.append(f'retrieve {batch_id}')
+        return types.SimpleNamespace(id=batch_id, processing_status='ended')
+
+    def _batch_results(self, batch_id):
+        self.calls.append(f'results {batch_id}')
+        if self.fail_results:
+            raise ConnectionError("results unavailable")
+        message = types.SimpleNamespace(content=[types.SimpleNamespace(text='batch ok')])
+        return [types.SimpleNamespace(custom_id='spec',
+                                      result=types.SimpleNamespace(type='succeeded', message=message))]
+
+
+class BatchResumeTest(unittest.TestCase):
+    inputs = {'issue_title': 'Title', 'issue_body': 'Body', 'codebase_context': ''}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, 'claude-cache')
+        for patch in (mock.patch.object(claude_api, 'CACHE_DIR', self.cache_dir),
+                      mock.patch.dict(claude_api._memory_cache, clear=True),
+                      mock.patch('sys.stderr', new_callable=io.StringIO)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_rerun_resumes_batch_instead_of_resubmitting(self):
+        first = _StubBatchAssistant(fail_results=True)
+        self.assertIsNone(first.run('spec', self.inputs))
+        with self.assertRaises(ConnectionError):
+            first.submit(poll_interval=0)
+        self.assertEqual(first.calls, ['create', 'retrieve batch_1', 'results batch_1'])
+
+        rerun = _StubBatchAssistant()
+        self.assertIsNone(rerun.run('spec', self.inputs))
+        self.assertEqual(rerun.submit(poll_interval=0), {'spec': 'batch ok'})
+        self.assertEqual(rerun.calls, ['retrieve batch_1', 'results batch_1'])
+
+        # Results are in: the batch id is dropped and the response is cached
+        self.assertFalse([name for name in os.listdir(self.cache_dir) if name.endswith('.id')])
+        self.assertEqual(_StubBatchAssistant().run('spec', self.inputs), 'batch ok')
+
+    def test_batch_id_resumes_explicitly(self):
+        assistant = _StubBatchAssistant()
+        assistant.run('spec', self.inputs)
+        self.assertEqual(assistant.submit(poll_interval=0, batch_id='batch_1'), {'spec': 'batch ok'})
+        self.assertNotIn('create', assistant.calls)
+
+
+def _playwright_spec(title: str, message: Optional[str] = None) -> dict:
+    """Build a failed spec as Playwright's JSON reporter writes it"""
+    result = {'status': 'failed', 'error': {'message': message}} if message else {'status': 'failed'}
+    return {'title': title, 'ok': False, 'file': 'e2e/app.spec.ts',
+            'tests': [{'status': 'unexpected', 'results': [result]}]}
+
+
+class FailureDedupeTest(unittest.TestCase):
+    def test_playwright_errors_are_read_from_test_results(self):
+        report = {'suites': [{'file': 'e2e/app.spec.ts', 'specs': [], 'suites': [{
+            'title': 'login',
+            'specs': [_playwright_spec('shows form', 'Error: timeout 5000ms\n  at app.spec.ts:12'),
+                      _playwright_spec('submits', 'Error: element not visible')],
+        }]}]}
+        failures = claude_api._extract_failures(report)
+
+        self.assertEqual([f['error'].split('\n')[0] for f in failures],
+                         ['Error: timeout 5000ms', 'Error: element not visible'])
+        exemplars, groups = claude_api._dedupe_failures(failures)
+        self.assertEqual(groups, 2)
+
+    def test_failures_without_messages_are_not_merged(self):
+        report = {'suites': [{'file': 'e2e/app.spec.ts',
+                              'specs': [_playwright_spec(f'test {i}') for i in range(3)]}]}
+        failures = claude_api._extract_failures(report)
+
+        self.assertEqual({f['error'] for f in failures}, {claude_api.UNKNOWN_ERROR})
+        exemplars, groups = claude_api._dedupe_failures(failures)
+        self.assertEqual(groups, 3)
+
+    def test_identical_errors_are_counted_once(self):
+        failures = [{'file': f'{i}.ts', 'test': 't', 'error': f'\x1b[31mTypeError at 0x{i:x}:{i}\x1b[0m'}
+                    for i in range(10, 14)]
+        exemplars, groups = claude_api._dedupe_failures(failures)
+
+        self.assertEqual(groups, 1)
+        self.assertEqual(exemplars[0]['count'], 4)
+
+
+class LoadTestReportTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'report.json')
+
+    def _load(self, report: dict) -> dict:
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(report, f)
+        return claude_api.load_test_report(self.path)
+
+    def test_playwright_failures_in_nested_suites_are_found(self):
+        passing = {'title': 'loads', 'ok': True, 'tests': []}
+        loaded = self._load({'config': {}, 'suites': [{
+            'file': 'e2e/app.spec.ts',
+            'specs': [passing],
+            'suites': [{'title': 'login', 'specs': [passing, _playwright_spec('submits', 'Error: timeout')]}],
+        }]})
+
+        failures = claude_api._extract_failures(loaded)
+        self.assertEqual(failures, [{'file': 'e2e/app.spec.ts', 'test': 'submits', 'error': 'Error: timeout'}])
+
+    def test_vitest_failures_are_found(self):
+        loaded = self._load({'numTotalTests': 2, 'testResults': [
+            {'name': 'a.test.ts', 'status': 'passed', 'assertionResults': [{'title': 'works'}]},
+            {'name': 'b.test.ts', 'status': 'failed', 'message': 'expected 1 to be 2',
+             'assertionResults': [{'title': 'adds'}]},
+        ]})
+
+        failures = claude_api._extract_failures(loaded)
+        self.assertEqual(failures, [{'file': 'b.test.ts', 'test': 'adds', 'error': 'expected 1 to be 2'}])
+
+    @unittest.skipUnless(importlib.util.find_spec('ijson'), 'needs ijson')
+    def test_streamed_report_keeps_only_failures(self):
+        loaded = self._load({'config': {}, 'suites': [
+            {'file': 'e2e/ok.spec.ts', 'specs': [{'title': 'loads', 'ok': True}]},
+            {'file': 'e2e/app.spec.ts', 'specs': [], 'suites': [{'specs': [_playwright_spec('submits')]}]},
+        ]})
+
+        self.assertEqual(loaded, {'suites': [{'file': 'e2e/app.spec.ts', 'specs': [_playwright_spec('submits')]}]})
+
+
+if __name__ == '__main__':
+    unittest.main()